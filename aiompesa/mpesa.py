@@ -1,20 +1,112 @@
+import asyncio
+import json
 import logging
-from datetime import datetime
-import base64
-from base64 import b64encode
+import math
+import os
+import time
+from base64 import b64decode
+from binascii import b2a_base64
+from functools import lru_cache
 from pathlib import Path
+from stat import S_ISREG
+from typing import Awaitable, Callable, List, Optional, Union
+from urllib.parse import urlsplit
 
 import aiohttp
-from M2Crypto import RSA, X509
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+
+try:
+    from pybase64 import b64encode
+except ImportError:
+
+    def b64encode(data: bytes) -> bytes:
+        return b2a_base64(data, newline=False)
+
+
+try:
+    from orjson import dumps as _json_dumps, loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
 
 from aiompesa.utils import is_url, saf_number_fmt
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(
+    total=30, connect=5, sock_connect=5, sock_read=20
+)
+
+_VALID_RESPONSE_TYPES = frozenset({"Cancelled", "Completed"})
+_VALID_B2C_COMMANDS = frozenset(
+    {"SalaryPayment", "BusinessPayment", "PromotionPayment"}
+)
+_VALID_B2B_COMMANDS = frozenset(
+    {
+        "BusinessPayBill",
+        "BusinessBuyGoods",
+        "DisburseFundsToBusiness",
+        "BusinessToBusinessTransfer",
+        "MerchantToMerchantTransfer.",
+    }
+)
+
+
+def _load_public_key(cert_data: bytes) -> RSAPublicKey:
+    """Loads the RSA public key of a PEM or DER encoded X509 certificate.
+
+    A PEM certificate the strict loader rejects has its body decoded with the
+    lenient `base64` module instead, since the certificates issued by
+    Safaricom are not always canonically encoded.
+    """
+    if b"-----BEGIN" not in cert_data:
+        cert = x509.load_der_x509_certificate(cert_data, default_backend())
+        return cert.public_key()
+    try:
+        cert = x509.load_pem_x509_certificate(cert_data, default_backend())
+    except ValueError:
+        body, in_body = [], False
+        for line in cert_data.splitlines():
+            if line.startswith(b"-----BEGIN"):
+                in_body = True
+            elif line.startswith(b"-----END"):
+                break
+            elif in_body:
+                body.append(line.strip())
+        cert = x509.load_der_x509_certificate(
+            b64decode(b"".join(body)), default_backend()
+        )
+    return cert.public_key()
+
+
+@lru_cache(maxsize=8)
+def _cached_public_key(cert_location: str, mtime: float) -> RSAPublicKey:
+    """Loads the public key of a certificate file once per modification time.
+
+    Keying on `mtime` means a rotated certificate is picked up without a
+    restart, while the bounded cache drops the stale key eventually.
+    """
+    return _load_public_key(Path(cert_location).read_bytes())
+
+
+@lru_cache(maxsize=32)
+def _password_prefix(short_code, lipa_na_mpesa_passkey) -> bytes:
+    """Encodes the fixed Shortcode + LNM Passkey part of an STK password."""
+    return f"{short_code}{lipa_na_mpesa_passkey}".encode()
+
 
 class Mpesa:
     """The Mpesa interface that will interact with MPESA endpoints.
 
+    All requests share one http session. Use the instance as an async context
+    manager, or await `aclose()` when done, to release its connections.
+
     Example:
 
     .. highlight:: python
@@ -26,17 +118,23 @@ class Mpesa:
         CONSUMER_KEY = "nF4OwB2XiuYZwmdMz3bovnzw2qMls1b7"
         CONSUMER_SECRET = "biIImmaAX9dYD4Pw"
 
-        loop = asyncio.get_event_loop()
-        mpesa = Mpesa(True, CONSUMER_KEY, CONSUMER_SECRET)
 
-        token_response = loop.run_until_complete(mpesa.generate_token())
+        async def main():
+            async with Mpesa(True, CONSUMER_KEY, CONSUMER_SECRET) as mpesa:
+                token_response = await mpesa.generate_token()
 
-        access_token = token_response.get("access_token", None)
-        expires_in = token_response.get("expires_in", None)
-        if access_token is None:
-            print("Error: Wrong credentials used to get the access_token")
-        else:
-            print(f"access_token = {access_token}, expires_in = {expires_in} secs")
+            access_token = token_response.get("access_token", None)
+            expires_in = token_response.get("expires_in", None)
+            if access_token is None:
+                print("Error: Wrong credentials used to get the access_token")
+            else:
+                print(
+                    f"access_token = {access_token}, "
+                    f"expires_in = {expires_in} secs"
+                )
+
+
+        asyncio.run(main())
     """
 
     SANDBOX_BASE_URL = "https://sandbox.safaricom.co.ke"
@@ -48,12 +146,27 @@ class Mpesa:
     B2B_URL_PATH = "/mpesa/b2b/v1/paymentrequest"
     STK_URL_PATH = "/mpesa/stkpush/v1/processrequest"
     REVERSAL_URL_PATH = "/mpesa/reversal/v1/request"
+    # Seconds before expiry at which a cached access token is refreshed.
+    TOKEN_EXPIRY_MARGIN = 30
+    # The errorCode the API responds with when an access token is rejected.
+    INVALID_TOKEN_ERROR_CODE = "404.001.03"
+    # Responses to GETs that are retried, and how many times, before giving up.
+    RETRY_STATUSES = frozenset({429, 502, 503, 504})
+    MAX_RETRIES = 3
+    # The longest wait, in seconds, before a retry, whatever Retry-After says.
+    MAX_RETRY_DELAY = 5.0
+    # Seconds for which the resolved addresses of the API host are cached.
+    DNS_CACHE_TTL = 300
 
     def __init__(
         self,
         sandbox: bool = True,
         consumer_key: str = None,
         consumer_secret: str = None,
+        limit: int = None,
+        timeout: aiohttp.ClientTimeout = DEFAULT_TIMEOUT,
+        connector_kwargs: dict = None,
+        rps: float = None,
     ):
         """Initialize parameters. Access them here http://bit.ly/2JoWdZM.
 
@@ -61,53 +174,275 @@ class Mpesa:
             sandbox: determines whether you are running in development or production.
             consumer_key: key required to make a request to the API.
             consumer_secret: secret required to make a request to the API.
+            limit: the maximum number of requests in flight at once. Defaults to
+                the AIOMPESA_LIMIT environment variable, or 20.
+            timeout: the `aiohttp.ClientTimeout` applied to every request.
+            connector_kwargs: keyword arguments for the `aiohttp.TCPConnector`
+                of the shared session, overriding its defaults.
+            rps: the maximum number of requests started per second, allowing
+                bursts of up to that many. Unlimited by default.
+
+        Raises:
+            ValueError: when `limit` is less than 1 or `rps` is not positive.
         """
         self.sandbox = sandbox
         if self.sandbox:
             self.base_url = self.SANDBOX_BASE_URL
         else:
             self.base_url = self.PRODUCTION_BASE_URL
+        self._host = urlsplit(self.base_url).netloc
+        self._base_headers = {
+            "Host": self._host,
+            "Content-Type": "application/json",
+        }
         self.consumer_key = consumer_key
         self.consumer_secret = consumer_secret
+        self._auth: Optional[aiohttp.BasicAuth] = None
+        self._basic_auth_header: Optional[str] = None
+        if consumer_key is not None and consumer_secret is not None:
+            self._auth = aiohttp.BasicAuth(consumer_key, consumer_secret)
+            self._basic_auth_header = self._auth.encode()
+        if limit is None:
+            limit = int(os.getenv("AIOMPESA_LIMIT", "20"))
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        self.limit = limit
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.timeout = timeout
+        self.connector_kwargs = connector_kwargs or {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._token: Optional[str] = None
+        self._cached_headers: Optional[dict] = None
+        self._token_expires_at: float = 0.0
+        self._token_lock: Optional[asyncio.Lock] = None
+        if rps is not None and rps <= 0:
+            raise ValueError("rps must be greater than 0")
+        self.rps = rps
+        self._rate_tokens = max(rps, 1.0) if rps else 0.0
+        self._rate_updated = time.monotonic()
+        self._rate_lock: Optional[asyncio.Lock] = None
+
+    def _init_locks(self) -> None:
+        """Creates the semaphore and locks of this instance on the running loop.
+
+        They bind to an event loop, the one current when they are created
+        before Python 3.10 and the first one they wait on after, so they are
+        created from a coroutine rather than in `__init__`, which may run
+        outside of any loop, and again whenever the instance is used on
+        another loop, e.g. by a second `asyncio.run`.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._sem = asyncio.Semaphore(self.limit)
+            self._token_lock = asyncio.Lock()
+            self._rate_lock = asyncio.Lock()
+            self._loop = loop
+
+    async def __aenter__(self) -> "Mpesa":
+        await self._get_session()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Returns the http session shared by every request of this instance.
+
+        The session is created on first use so that its connection pool, and
+        the keep-alive connections to the API in it, are reused across calls.
+        A session left open on another event loop, e.g. by an earlier
+        `asyncio.run`, is replaced since its connections cannot be used here,
+        and closed on its own loop if that is still open.
+        """
+        self._init_locks()
+        loop = asyncio.get_running_loop()
+        if self._session is not None and self._session_loop is not loop:
+            if not self._session_loop.is_closed():
+                asyncio.run_coroutine_threadsafe(
+                    self._session.close(), self._session_loop
+                )
+            else:
+                # The session cannot be closed once its loop is gone, so it is
+                # deliberately dropped and aiohttp warns that it was unclosed.
+                logger.warning(
+                    "Dropping a session left open on a closed event loop, "
+                    "await aclose() before the loop closes to avoid this"
+                )
+            self._session = None
+        if self._session is None or self._session.closed:
+            kwargs = {
+                "limit": self.limit,
+                "limit_per_host": self.limit,
+                "use_dns_cache": True,
+                "ttl_dns_cache": self.DNS_CACHE_TTL,
+                "keepalive_timeout": 75,
+                **self.connector_kwargs,
+            }
+            connector = aiohttp.TCPConnector(**kwargs)
+            self._session = aiohttp.ClientSession(
+                base_url=self.base_url,
+                connector=connector,
+                timeout=self.timeout,
+            )
+            self._session_loop = loop
+        return self._session
+
+    async def aclose(self) -> None:
+        """Closes the shared http session and its pooled connections."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    close = aclose
 
     @staticmethod
-    async def get(session: aiohttp.ClientSession, url: str) -> dict:
+    async def _read_json(response: aiohttp.ClientResponse) -> dict:
+        """Decodes the JSON body of a response.
+
+        The body is read once and the Content-Type is inspected first so that
+        the HTML or plain text error pages returned by the API do not go
+        through a failing decode.
+
+        Args:
+            response: A response from `aiohttp`.
+
+        Returns:
+            A dict of the decoded body, or a dict with the `error` and `status`
+            of a response whose body is not a JSON object.
+        """
+        body = await response.read()
+        if "json" in response.content_type:
+            try:
+                data = _json_loads(body)
+            except ValueError as e:
+                logger.debug("Failed to decode the response: %s", e)
+                return {"error": f"{e}", "status": response.status}
+            if isinstance(data, dict):
+                return data
+        text = body.decode("utf-8", "replace")
+        return {"error": text or response.reason, "status": response.status}
+
+    @classmethod
+    def _is_retryable(
+        cls, response: aiohttp.ClientResponse, idempotent: bool
+    ) -> bool:
+        """Checks whether a request can be sent again after this response.
+
+        A 502 or 504 to a POST may come after the API has processed it, e.g.
+        made a payment, so requests that are not idempotent are only retried
+        when the API refused them: a 429, or a 503 with a Retry-After header.
+        """
+        if idempotent:
+            return response.status in cls.RETRY_STATUSES
+        if response.status == 503:
+            return "Retry-After" in response.headers
+        return response.status == 429
+
+    @classmethod
+    async def _request_with_retry(
+        cls,
+        request,
+        url: str,
+        idempotent: bool = False,
+        throttle: Callable[[], Awaitable[None]] = None,
+        **kwargs,
+    ) -> dict:
+        """Performs a request, retrying it while the API is rate limiting.
+
+        Retryable responses, see :meth:`_is_retryable`, are retried up to
+        `MAX_RETRIES` times. Each retry waits for the number of seconds in the
+        Retry-After header, up to `MAX_RETRY_DELAY`, or else backs off
+        exponentially.
+
+        Args:
+            request: The `aiohttp` session method used to send the request.
+            url: A URL you want to make a request to.
+            idempotent: Whether the request can safely be sent more than once.
+            throttle: A coroutine function awaited before every attempt, so
+                that retries are rate limited like the first request.
+            kwargs: Keyword arguments passed on to `request`.
+
+        Returns:
+            A dict mapping the response from the URL passed to their values.
+        """
+        for attempt in range(cls.MAX_RETRIES + 1):
+            if throttle is not None:
+                await throttle()
+            async with request(url, **kwargs) as response:
+                last_attempt = attempt == cls.MAX_RETRIES
+                if last_attempt or not cls._is_retryable(response, idempotent):
+                    return await cls._read_json(response)
+                try:
+                    delay = float(response.headers["Retry-After"])
+                except (KeyError, ValueError):
+                    delay = -1.0
+                # A "nan" or "inf" header would never let the sleep return.
+                if not (math.isfinite(delay) and delay >= 0):
+                    delay = min(2**attempt * 0.1, 2.0)
+            logger.debug(
+                "Retrying %s after a %s response", url, response.status
+            )
+            await asyncio.sleep(min(delay, cls.MAX_RETRY_DELAY))
+
+    @classmethod
+    async def get(
+        cls,
+        session: aiohttp.ClientSession,
+        url: str,
+        headers: dict = None,
+        throttle: Callable[[], Awaitable[None]] = None,
+    ) -> dict:
         """Performs an async GET request to the URL provided.
 
         Args:
             session: An http session from `aiohttp`.
             url: A URL you want to make a GET request to.
+            headers: Extra headers to send along with this request.
+            throttle: A coroutine function awaited before every attempt.
 
         Returns:
             A dict mapping the response from the URL passed to their values.
         """
-        async with session.get(url) as response:
-            try:
-                return await response.json()
-            except Exception as e:
-                logger.debug(e)
-                return {"error": f"{e}", "status": response.status}
+        return await cls._request_with_retry(
+            session.get,
+            url,
+            idempotent=True,
+            throttle=throttle,
+            headers=headers,
+        )
 
-    @staticmethod
+    @classmethod
     async def post(
-        session: aiohttp.ClientSession, url: str, data: dict
+        cls,
+        session: aiohttp.ClientSession,
+        url: str,
+        data: Union[dict, bytes],
+        headers: dict = None,
+        throttle: Callable[[], Awaitable[None]] = None,
     ) -> dict:
         """Performs an async POST request to the URL provided.
 
         Args:
             session: An http session from `aiohttp`
             url: A URL you want to make a request to
-            data: The values you want to POST to the URL
+            data: The values you want to POST to the URL, either as a dict or
+                as an already serialized JSON body.
+            headers: Extra headers to send along with this request. They should
+                carry the JSON Content-Type.
+            throttle: A coroutine function awaited before every attempt.
 
         Returns:
             A dict mapping the response from the URL passed to their values.
         """
-        async with session.post(url, json=data) as response:
-            try:
-                return await response.json()
-            except Exception as e:
-                logger.debug(e)
-                return {"error": f"{e}", "status": response.status}
+        if not isinstance(data, bytes):
+            data = _json_dumps(data)
+        if headers is None:
+            headers = {"Content-Type": "application/json"}
+        return await cls._request_with_retry(
+            session.post, url, throttle=throttle, data=data, headers=headers
+        )
 
     @staticmethod
     def generate_security_credential(
@@ -116,7 +451,8 @@ class Mpesa:
         """Create a security credential.
 
         Encodes into base64 string the initiator password with M-Pesa’s
-        public key and a X509 certificate.
+        public key and a X509 certificate. The public key is parsed once per
+        certificate file and reused until the file changes.
 
         Args:
             cert_location: a file location of the production/sandbox X509
@@ -129,22 +465,56 @@ class Mpesa:
                 found on the system.
 
         Returns:
-            A base64 value of the encoded password and file.
+            A base64 string of the encrypted password.
         """
-        cert_path = Path(cert_location)
-        if cert_path.is_file() and cert_path.exists():
-            with cert_path.open(mode="rt") as f:
-                cert_data = f.read()
-
-            cert = X509.load_cert_string(cert_data)
-            pub_key = cert.get_pubkey()
-            rsa_key = pub_key.get_rsa()
-            cipher = rsa_key.public_encrypt(
-                initiator_password.encode(), RSA.pkcs1_padding
-            )
-            return b64encode(cipher)
-        else:
+        try:
+            cert_stat = os.stat(cert_location)
+        except OSError:
+            raise FileNotFoundError(cert_location) from None
+        if not S_ISREG(cert_stat.st_mode):
             raise FileNotFoundError(cert_location)
+        public_key = _cached_public_key(cert_location, cert_stat.st_mtime)
+        cipher = public_key.encrypt(
+            initiator_password.encode(), padding.PKCS1v15()
+        )
+        return b64encode(cipher).decode("ascii")
+
+    @staticmethod
+    async def generate_security_credential_async(
+        cert_location: str, initiator_password: str
+    ) -> str:
+        """Create a security credential without blocking the event loop.
+
+        Runs :meth:`generate_security_credential` in the loop's default
+        executor, where the RSA encryption releases the GIL.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None,
+            Mpesa.generate_security_credential,
+            cert_location,
+            initiator_password,
+        )
+
+    @staticmethod
+    async def generate_security_credentials(
+        cert_location: str, initiator_passwords: List[str]
+    ) -> List[str]:
+        """Create the security credentials of many initiator passwords.
+
+        The encryptions run in parallel in the loop's default executor.
+
+        Returns:
+            A list of base64 strings, in the same order as the passwords.
+        """
+        return await asyncio.gather(
+            *(
+                Mpesa.generate_security_credential_async(
+                    cert_location, password
+                )
+                for password in initiator_passwords
+            )
+        )
 
     @staticmethod
     def generate_password(short_code, lipa_na_mpesa_passkey) -> tuple:
@@ -161,49 +531,161 @@ class Mpesa:
         Returns:
             a tuple of two strings which are the password and the timestamp
         """
-        now = datetime.now()
-        timestamp = now.strftime("%Y%m%d%H%M%S")
-        password = f"{short_code}{lipa_na_mpesa_passkey}{timestamp}"
-        password = base64.b64encode(password.encode()).decode()
+        timestamp = time.strftime("%Y%m%d%H%M%S")
+        prefix = _password_prefix(short_code, lipa_na_mpesa_passkey)
+        password = b64encode(prefix + timestamp.encode("ascii"))
+        password = password.decode("ascii")
         return password, timestamp
 
+    def _token_is_valid(self) -> bool:
+        """Checks whether the cached access token can still be used."""
+        expires_at = self._token_expires_at - self.TOKEN_EXPIRY_MARGIN
+        return self._token is not None and time.monotonic() < expires_at
+
     async def generate_token(self) -> dict:
         """Generates an access token from the API.
 
+        The token is cached until shortly before it expires and concurrent
+        callers share a single refresh request.
+
         Returns:
             A dict with `access_token` that is a string value and `expires_in`
             that is also a string value
 
             {"access_token": "4UkKg50WyGADbzAZWW8iRtmTGwPw", "expires_in": "3599"}
+
+        Raises:
+            ValueError: when the consumer_key or consumer_secret is missing.
         """
-        url = f"{self.base_url}{self.GENERATE_TOKEN_PATH}"
-        auth = aiohttp.BasicAuth(self.consumer_key, self.consumer_secret)
-        async with aiohttp.ClientSession(auth=auth) as session:
-            response = await self.get(session, url)
-            error = response.get("error", None)
-            if error is not None:
+        self._init_locks()
+        async with self._token_lock:
+            if self._token_is_valid():
+                expires_in = int(self._token_expires_at - time.monotonic())
+                return {
+                    "access_token": self._token,
+                    "expires_in": f"{expires_in}",
+                }
+
+            if self._auth is None:
+                raise ValueError(
+                    "consumer_key and consumer_secret are required"
+                )
+            session = await self._get_session()
+            async with self._sem:
+                response = await self.get(
+                    session,
+                    self.GENERATE_TOKEN_PATH,
+                    headers={"Authorization": self._basic_auth_header},
+                    throttle=self._throttle,
+                )
+            # Error dicts from `get` and error bodies from the API (e.g. 5xx
+            # responses) carry no token, so only a response with one is cached.
+            access_token = response.get("access_token", None)
+            if not access_token:
                 return {"access_token": None, "expires_in": None}
+            try:
+                expires_in = int(float(response.get("expires_in", 0)))
+            except (TypeError, ValueError, OverflowError):
+                expires_in = 0
+            self._token = access_token
+            self._cached_headers = {
+                **self._base_headers,
+                "Authorization": f"Bearer {access_token}",
+            }
+            self._token_expires_at = time.monotonic() + expires_in
             return response
 
     async def _get_headers(self) -> dict:
         """Assembles the headers for an MPESA request.
 
+        While the cached access token is valid the same headers dict is
+        returned on every call, so it must not be mutated.
+
         Returns:
             A dict with the available headers for a request to the API.
         Raises:
             ValueError: when the `access_token` is invalid.
         """
-        headers = {
-            "Host": f"{self.base_url[8:]}",
-            "Content-Type": "application/json",
-        }
+        if self._token_is_valid():
+            return self._cached_headers
+
         token = await self.generate_token()
         access_token = token.get("access_token", None)
         if access_token is None:
             raise ValueError("Invalid access token value")
-        headers["Authorization"] = f"Bearer {access_token}"
+        if self._token == access_token:
+            return self._cached_headers
+        return {
+            **self._base_headers,
+            "Authorization": f"Bearer {access_token}",
+        }
+
+    async def _throttle(self) -> None:
+        """Waits until a request may start without exceeding `rps`.
 
-        return headers
+        A token bucket holding up to `rps` tokens (at least one) is refilled
+        continuously and every request, retries included, takes a token from
+        it.
+        """
+        if not self.rps:
+            return
+        self._init_locks()
+        async with self._rate_lock:
+            now = time.monotonic()
+            self._rate_tokens = min(
+                max(self.rps, 1.0),
+                self._rate_tokens + (now - self._rate_updated) * self.rps,
+            )
+            self._rate_updated = now
+            if self._rate_tokens < 1:
+                await asyncio.sleep((1 - self._rate_tokens) / self.rps)
+                self._rate_tokens = 1.0
+                self._rate_updated = time.monotonic()
+            self._rate_tokens -= 1
+
+    async def _authorized_post(
+        self, url: str, data: Union[dict, bytes]
+    ) -> dict:
+        """POSTs `data` to `url` over the shared session with auth headers.
+
+        When the API rejects the cached access token, it is dropped and the
+        request is sent once more with a freshly generated one.
+        """
+        session = await self._get_session()
+        for _ in range(2):
+            # Skip the coroutine entirely while the cached token is valid.
+            if self._token_is_valid():
+                headers = self._cached_headers
+            else:
+                headers = await self._get_headers()
+            async with self._sem:
+                response = await self.post(
+                    session,
+                    url,
+                    data,
+                    headers=headers,
+                    throttle=self._throttle,
+                )
+            if response.get("errorCode") != self.INVALID_TOKEN_ERROR_CODE:
+                break
+            # Only drop the token this request used, not one that a
+            # concurrent request has already refreshed.
+            if headers is self._cached_headers:
+                self._token = None
+        return response
+
+    async def _authorized_post_many(
+        self, url: str, payloads: List[Union[dict, bytes]]
+    ) -> List[dict]:
+        """POSTs every payload to `url` concurrently.
+
+        The access token is fetched once up front so that the requests do not
+        all wait on the same refresh.
+        """
+        await self._get_headers()
+        return await asyncio.gather(
+            *(self._authorized_post(url, payload) for payload in payloads)
+        )
 
     async def register_url(
         self,
@@ -241,7 +723,7 @@ class Mpesa:
             ValueError: when the response_type is not Cancelled/Completed or when the
                 validation_url and confirmation_url are not valid URLs.
         """
-        if response_type not in ["Cancelled", "Completed"]:
+        if response_type not in _VALID_RESPONSE_TYPES:
             raise ValueError(
                 f"{response_type} is not a valid ResponseType value"
             )
@@ -250,17 +732,13 @@ class Mpesa:
         if not is_url(validation_url):
             raise ValueError(f"{validation_url} is not a valid url value")
 
-        headers = await self._get_headers()
-        url = f"{self.base_url}{self.REGISTER_URL_PATH}"
         data = {
             "ShortCode": shortcode,
             "ResponseType": response_type,
             "ConfirmationURL": confirmation_url,
             "ValidationURL": validation_url,
         }
-
-        async with aiohttp.ClientSession(headers=headers) as session:
-            return await self.post(session=session, url=url, data=data)
+        return await self._authorized_post(self.REGISTER_URL_PATH, data)
 
     async def c2b(
         self,
@@ -290,7 +768,63 @@ class Mpesa:
         Raises:
             ValueError: when the phone_number supplied is not a valid phone number.
         """
-        url = f"{self.base_url}{self.C2B_URL_PATH}"
+        data = self._c2b_payload(shortcode, amount, phone_number)
+        return await self._authorized_post(self.C2B_URL_PATH, data)
+
+    async def c2b_many(self, requests: List[dict]) -> List[dict]:
+        """Simulate many payments from clients to Safaricom API concurrently.
+
+        Every payload is validated before anything is sent. The access token is
+        then fetched once and the requests share the session's connections,
+        with at most `limit` of them in flight.
+
+        Args:
+            requests: a list of dicts with the `shortcode`, `amount` and
+                `phone_number` arguments of :meth:`c2b`.
+
+        Returns:
+            A list of the responses, in the same order as the requests.
+
+        Raises:
+            ValueError: when any phone_number supplied is not a valid phone number.
+        """
+        payloads = [self._c2b_payload(**request) for request in requests]
+        return await self._authorized_post_many(self.C2B_URL_PATH, payloads)
+
+    @staticmethod
+    def c2b_payload(
+        shortcode: str = None, amount: int = None, phone_number: str = None
+    ) -> bytes:
+        """Builds the serialized JSON body of a c2b request.
+
+        Payloads are cached, so repeated simulations with the same arguments
+        only encode their body once.
+
+        Args:
+            shortcode: a paybill number/till number, which you expect to receive
+                payments notifications about.
+            amount: the amount in KSh you are sending to a businees.
+            phone_number: a valid safaricom number you are sending money from.
+
+        Returns:
+            The JSON encoded request body as bytes.
+
+        Raises:
+            ValueError: when the phone_number supplied is not a valid phone number.
+        """
+        return Mpesa._c2b_payload(shortcode, amount, phone_number)
+
+    @staticmethod
+    @lru_cache(maxsize=128, typed=True)
+    def _c2b_payload(
+        shortcode: str = None, amount: int = None, phone_number: str = None
+    ) -> bytes:
+        """Builds the serialized body of a c2b request. See :meth:`c2b`.
+
+        Bodies are cached, so repeated simulations with the same arguments
+        only encode once. The cache is typed so that e.g. an `amount` of 100
+        and of 100.0 keep their own bodies.
+        """
         number, valid = saf_number_fmt(phone_number)
         if not valid:
             raise ValueError(f"{phone_number} is not a valid Safaricom number")
@@ -298,14 +832,11 @@ class Mpesa:
         data = {
             "ShortCode": shortcode,
             "CommandID": "CustomerPayBillOnline",
-            "Amount": f"{amount}",
+            "Amount": str(amount),
             "Msisdn": number,
             "BillRefNumber": number,
         }
-        headers = await self._get_headers()
-
-        async with aiohttp.ClientSession(headers=headers) as session:
-            return await self.post(session=session, url=url, data=data)
+        return _json_dumps(data)
 
     async def b2c(
         self,
@@ -359,32 +890,73 @@ class Mpesa:
                 command_id is not SalaryPayment, BusinessPayment or
                 PromotionPayment.
         """
-        url = f"{self.base_url}{self.B2C_URL_PATH}"
+        data = self._b2c_payload(
+            initiator_name,
+            security_credential,
+            command_id,
+            amount,
+            party_a,
+            party_b,
+            remarks,
+            queue_timeout_url,
+            result_url,
+            occassion,
+        )
+        return await self._authorized_post(self.B2C_URL_PATH, data)
+
+    async def b2c_many(self, requests: List[dict]) -> List[dict]:
+        """Make many payments from MPESA to clients concurrently.
+
+        Every payload is validated before anything is sent. The access token is
+        then fetched once and the requests share the session's connections,
+        with at most `limit` of them in flight.
+
+        Args:
+            requests: a list of dicts with the arguments of :meth:`b2c`.
+
+        Returns:
+            A list of the responses, in the same order as the requests.
+
+        Raises:
+            ValueError: when any party_b is not a valid Safaricom number or
+                command_id is not a valid CommandID value.
+        """
+        payloads = [self._b2c_payload(**request) for request in requests]
+        return await self._authorized_post_many(self.B2C_URL_PATH, payloads)
+
+    @staticmethod
+    def _b2c_payload(
+        initiator_name: str = None,
+        security_credential: str = None,
+        command_id: str = None,
+        amount: int = None,
+        party_a: str = None,
+        party_b: str = None,
+        remarks: str = None,
+        queue_timeout_url: str = None,
+        result_url: str = None,
+        occassion: str = "",
+    ) -> bytes:
+        """Builds the serialized body of a b2c request. See :meth:`b2c`."""
         phone_number, valid = saf_number_fmt(party_b)
         if not valid:
             raise ValueError(f"{party_b} is not a valid Safaricom number")
-        if command_id not in [
-            "SalaryPayment",
-            "BusinessPayment",
-            "PromotionPayment",
-        ]:
+        if command_id not in _VALID_B2C_COMMANDS:
             raise ValueError(f"{command_id} is not a valid CommandID value")
-        data = {
-            "InitiatorName": initiator_name,
-            "SecurityCredential": security_credential,
-            "CommandID": command_id,
-            "Amount": f"{amount}",
-            "PartyA": party_a,
-            "PartyB": phone_number,
-            "Remarks": remarks,
-            "QueueTimeOutURL": queue_timeout_url,
-            "ResultURL": result_url,
-            "Occassion": occassion,
-        }
-        headers = await self._get_headers()
-
-        async with aiohttp.ClientSession(headers=headers) as session:
-            return await self.post(session=session, url=url, data=data)
+        return _json_dumps(
+            {
+                "InitiatorName": initiator_name,
+                "SecurityCredential": security_credential,
+                "CommandID": command_id,
+                "Amount": str(amount),
+                "PartyA": party_a,
+                "PartyB": phone_number,
+                "Remarks": remarks,
+                "QueueTimeOutURL": queue_timeout_url,
+                "ResultURL": result_url,
+                "Occassion": occassion,
+            }
+        )
 
     async def b2b(
         self,
@@ -436,14 +1008,7 @@ class Mpesa:
                 DisburseFundsToBusiness, BusinessToBusinessTransfer or
                 MerchantToMerchantTransfer.
         """
-        url = f"{self.base_url}{self.B2B_URL_PATH}"
-        if command_id not in [
-            "BusinessPayBill",
-            "BusinessBuyGoods",
-            "DisburseFundsToBusiness",
-            "BusinessToBusinessTransfer",
-            "MerchantToMerchantTransfer.",
-        ]:
+        if command_id not in _VALID_B2B_COMMANDS:
             raise ValueError(
                 f"{command_id} is not a valid CommandID value for b2b request"
             )
@@ -454,17 +1019,14 @@ class Mpesa:
             "CommandID": command_id,
             "SenderIdentifierType": "4",
             "RecieverIdentifierType": "4",
-            "Amount": f"{amount}",
+            "Amount": str(amount),
             "PartyA": party_a,
             "PartyB": party_b,
             "Remarks": remarks,
             "QueueTimeOutURL": queue_timeout_url,
             "ResultURL": result_url,
         }
-        headers = await self._get_headers()
-
-        async with aiohttp.ClientSession(headers=headers) as session:
-            return await self.post(session=session, url=url, data=data)
+        return await self._authorized_post(self.B2B_URL_PATH, data)
 
     async def stk_push(
         self,
@@ -509,7 +1071,49 @@ class Mpesa:
 
             Any other value is a failed request.
         """
-        url = f"{self.base_url}{self.STK_URL_PATH}"
+        data = self._stk_push_payload(
+            lipa_na_mpesa_shortcode,
+            lipa_na_mpesa_passkey,
+            amount,
+            party_a,
+            party_b,
+            callback_url,
+            transaction_desc,
+            transaction_type,
+        )
+        return await self._authorized_post(self.STK_URL_PATH, data)
+
+    async def stk_push_many(self, requests: List[dict]) -> List[dict]:
+        """Make many STK pushes concurrently.
+
+        Every payload is validated before anything is sent. The access token is
+        then fetched once and the requests share the session's connections,
+        with at most `limit` of them in flight.
+
+        Args:
+            requests: a list of dicts with the arguments of :meth:`stk_push`.
+
+        Returns:
+            A list of the responses, in the same order as the requests.
+
+        Raises:
+            ValueError: when any party_a value is not a valid Safaricom number.
+        """
+        payloads = [self._stk_push_payload(**request) for request in requests]
+        return await self._authorized_post_many(self.STK_URL_PATH, payloads)
+
+    @staticmethod
+    def _stk_push_payload(
+        lipa_na_mpesa_shortcode: str = None,
+        lipa_na_mpesa_passkey: str = None,
+        amount: int = None,
+        party_a: str = None,
+        party_b: str = None,
+        callback_url: str = None,
+        transaction_desc: str = None,
+        transaction_type: str = "CustomerPayBillOnline",
+    ) -> bytes:
+        """Builds the serialized body of an STK push. See :meth:`stk_push`."""
         number, valid = saf_number_fmt(party_a)
         if not valid:
             raise ValueError(f"{party_a} is not a valid Safaricom number")
@@ -517,23 +1121,21 @@ class Mpesa:
         password, timestamp = Mpesa.generate_password(
             lipa_na_mpesa_shortcode, lipa_na_mpesa_passkey
         )
-        data = {
-            "BusinessShortCode": lipa_na_mpesa_shortcode,
-            "Password": password,
-            "Timestamp": timestamp,
-            "TransactionType": transaction_type,
-            "Amount": f"{amount}",
-            "PartyA": number,
-            "PartyB": lipa_na_mpesa_shortcode,
-            "PhoneNumber": number,
-            "CallBackURL": callback_url,
-            "AccountReference": number,
-            "TransactionDesc": transaction_desc,
-        }
-        headers = await self._get_headers()
-
-        async with aiohttp.ClientSession(headers=headers) as session:
-            return await self.post(session=session, url=url, data=data)
+        return _json_dumps(
+            {
+                "BusinessShortCode": lipa_na_mpesa_shortcode,
+                "Password": password,
+                "Timestamp": timestamp,
+                "TransactionType": transaction_type,
+                "Amount": str(amount),
+                "PartyA": number,
+                "PartyB": lipa_na_mpesa_shortcode,
+                "PhoneNumber": number,
+                "CallBackURL": callback_url,
+                "AccountReference": number,
+                "TransactionDesc": transaction_desc,
+            }
+        )
 
     async def reversal(
         self,
@@ -564,13 +1166,12 @@ class Mpesa:
                 sent.
             occassion: a very short description of the transaction from your end.
         """
-        url = f"{self.base_url}{self.REVERSAL_URL_PATH}"
         data = {
             "Initiator": initiator,
             "SecurityCredential": security_credential,
             "CommandID": "TransactionReversal",
             "TransactionID": transaction_id,
-            "Amount": f"{amount}",
+            "Amount": str(amount),
             "ReceiverParty": receiver_party,
             "RecieverIdentifierType": "4",
             "ResultURL": result_url,
@@ -578,7 +1179,4 @@ class Mpesa:
             "Remarks": remarks,
             "Occasion": occasion,
         }
-        headers = await self._get_headers()
-
-        async with aiohttp.ClientSession(headers=headers) as session:
-            return await self.post(session=session, url=url, data=data)
+        return await self._authorized_post(self.REVERSAL_URL_PATH, data)
@@ -1,26 +1,64 @@
-from urllib.parse import urlparse
 import re
+from functools import lru_cache
+
+_URL_RE = re.compile(r"https?://[^/\s]+/[^\s]*")
+# The prefixes of Safaricom numbers, http://bit.ly/2N3XB9b: 700-708, 710-729,
+# 740-741, 757-759 and 790-799.
+_SAF_PREFIXES = frozenset().union(
+    (f"70{i}" for i in range(9)),
+    (f"7{i}" for i in range(10, 30)),
+    ("740", "741", "757", "758", "759"),
+    (f"79{i}" for i in range(10)),
+)
+_DIGITS = frozenset("0123456789")
+
+
+@lru_cache(maxsize=256)
+def _is_url(url):
+    return _URL_RE.fullmatch(url) is not None
 
 
 def is_url(url):
-    """Check if a given string is a valid URL."""
+    """Check if a given string is a valid http(s) URL with a path.
+
+    Results are cached on the exact string, so callers should strip
+    whitespace first if they want equal urls to share an entry.
+    """
     try:
-        result = urlparse(url)
-        return all([result.scheme, result.netloc, result.path])
-    except Exception:
+        return _is_url(url)
+    except TypeError:
         return False
 
 
+def is_url_many(urls):
+    """Checks many urls at once. See :func:`is_url`."""
+    check = is_url
+    return [check(url) for url in urls]
+
+
+@lru_cache(maxsize=4096)
 def saf_number_fmt(phone_number):
     """Checks if a given number is a valid Safaricom number.
 
-    Checks the formats mentioned in http://bit.ly/2N3XB9b
+    Checks the formats mentioned in http://bit.ly/2N3XB9b. Results are
+    cached, so repeated sends to the same number skip the checks.
     """
-    saf_number_regex = re.compile(
-        r"^(?:254|\+254|0)?(7(?:(?:[129][0-9])|(?:0[0-8])|(5[789])|"
-        "(4[0-1]))[0-9]{6})$"
-    )
-    valid = re.match(saf_number_regex, phone_number)
-    if valid is not None:
-        return f"254{valid.group()[-9:]}", True
-    return valid, False
+    if phone_number.startswith("+254"):
+        number = phone_number[4:]
+    elif phone_number.startswith("254"):
+        number = phone_number[3:]
+    elif phone_number.startswith("0"):
+        number = phone_number[1:]
+    else:
+        number = phone_number
+    if len(number) != 9 or number[:3] not in _SAF_PREFIXES:
+        return None, False
+    if not _DIGITS.issuperset(number):
+        return None, False
+    return f"254{number}", True
+
+
+def saf_number_fmt_many(phone_numbers):
+    """Checks many numbers at once. See :func:`saf_number_fmt`."""
+    fmt = saf_number_fmt
+    return [fmt(phone_number) for phone_number in phone_numbers]
@@ -20,54 +20,50 @@ SEC_CREDENTIAL = (
 )
 INITIATOR_NAME = "apitest376"
 
-if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    mpesa = Mpesa(True, CONSUMER_KEY, CONSUMER_SECRET)
 
-    print("--- Getting the access token ---")
-    token_response = loop.run_until_complete(mpesa.generate_token())
-    access_token = token_response.get("access_token", None)
-    expires_in = token_response.get("expires_in", None)
-    if access_token is None:
-        print("Error: Wrong credentials used to get the access_token")
-    else:
-        print(f"access_token = {access_token}, expires_in = {expires_in} secs")
-    print("--- Done getting the access token ---")
+async def main():
+    async with Mpesa(True, CONSUMER_KEY, CONSUMER_SECRET) as mpesa:
+        print("--- Getting the access token ---")
+        token_response = await mpesa.generate_token()
+        access_token = token_response.get("access_token", None)
+        expires_in = token_response.get("expires_in", None)
+        if access_token is None:
+            print("Error: Wrong credentials used to get the access_token")
+        else:
+            print(
+                f"access_token = {access_token}, "
+                f"expires_in = {expires_in} secs"
+            )
+        print("--- Done getting the access token ---")
 
-    print("--- MPESA URL registration running ---")
-    response = loop.run_until_complete(
-        mpesa.register_url(
+        print("--- MPESA URL registration running ---")
+        response = await mpesa.register_url(
             response_type="Cancelled",
             shortcode=SHORT_CODE_1,
             confirmation_url="https://www.aio.co.ke/confirm",
             validation_url="https://www.aio.co.ke/validate",
         )
-    )
-    error = response.get("errorMessage", None)
-    if error is not None:
-        print("An error occured during registration of urls")
-    print(response)
-    print("--- MPESA URL registation done ---")
+        error = response.get("errorMessage", None)
+        if error is not None:
+            print("An error occured during registration of urls")
+        print(response)
+        print("--- MPESA URL registation done ---")
 
-    print("--- MPESA c2b running ---")
-    c2b = loop.run_until_complete(
-        mpesa.c2b(
+        print("--- MPESA c2b running ---")
+        c2b = await mpesa.c2b(
             amount=100, shortcode=SHORT_CODE_1, phone_number="0705867162"
         )
-    )
-    print(c2b)
-    print("--- MPESA c2b done running---")
+        print(c2b)
+        print("--- MPESA c2b done running---")
 
-    print("--- Generate the initiator password ---")
-    sec_cred = mpesa.generate_security_credential(
-        cert_location="examples/cert.cer", initiator_password="whoas"
-    )
-    sec_cred = sec_cred.decode()
-    print("--- Done generating secret credentials ---")
-    print("--- MPESA b2c running ---")
-    party_b = "254705867162"
-    b2c = loop.run_until_complete(
-        mpesa.b2c(
+        print("--- Generate the initiator password ---")
+        sec_cred = mpesa.generate_security_credential(
+            cert_location="examples/cert.cer", initiator_password="whoas"
+        )
+        print("--- Done generating secret credentials ---")
+        print("--- MPESA b2c running ---")
+        party_b = "254705867162"
+        b2c = await mpesa.b2c(
             initiator_name=INITIATOR_NAME,
             security_credential=sec_cred,
             command_id="BusinessPayment",
@@ -78,12 +74,10 @@ if __name__ == "__main__":
             queue_timeout_url="https://www.aio.co.ke/queue/",
             result_url="https://www.aio.co.ke/result/",
         )
-    )
-    print(b2c)
-    print("--- MPESA done running b2c ---")
-    print("--- MPESA b2b running ---")
-    b2b = loop.run_until_complete(
-        mpesa.b2b(
+        print(b2c)
+        print("--- MPESA done running b2c ---")
+        print("--- MPESA b2b running ---")
+        b2b = await mpesa.b2b(
             initiator_name=INITIATOR_NAME,
             security_credential=sec_cred,
             command_id="BusinessBuyGoods",
@@ -94,13 +88,11 @@ if __name__ == "__main__":
             queue_timeout_url="https://www.aio.co.ke/queue/",
             result_url="https://www.aio.co.ke/result/",
         )
-    )
-    print(b2b)
-    print("--- MPESA b2b done running ---")
+        print(b2b)
+        print("--- MPESA b2b done running ---")
 
-    print("--- MPESA b2b running ---")
-    stk = loop.run_until_complete(
-        mpesa.stk_push(
+        print("--- MPESA b2b running ---")
+        stk = await mpesa.stk_push(
             lipa_na_mpesa_shortcode=LIPA_NA_MPESA,
             lipa_na_mpesa_passkey=LIPA_NA_MPESA_KEY,
             amount=100,
@@ -109,14 +101,12 @@ if __name__ == "__main__":
             transaction_desc=f"Deposit from {party_b}",
             callback_url="https://www.aio.co.ke/queue/",
         )
-    )
-    print(stk)
-    print("--- MPESA stk done running ---")
+        print(stk)
+        print("--- MPESA stk done running ---")
 
-    print("--- MPESA reversal running ---")
-    transaction_id = "AG_20190623_0000659f5c6b1e2dcb74"
-    rev = loop.run_until_complete(
-        mpesa.reversal(
+        print("--- MPESA reversal running ---")
+        transaction_id = "AG_20190623_0000659f5c6b1e2dcb74"
+        rev = await mpesa.reversal(
             initiator=INITIATOR_NAME,
             security_credential=sec_cred,
             transaction_id=transaction_id,
@@ -127,6 +117,9 @@ if __name__ == "__main__":
             remarks=f"Wrongly input amount",
             occasion="Work",
         )
-    )
-    print(rev)
-    print("--- MPESA reversal done running ---")
+        print(rev)
+        print("--- MPESA reversal done running ---")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
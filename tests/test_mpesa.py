@@ -1,390 +1,769 @@
 import asyncio
+import gc
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from unittest import mock
 
 import pytest
 import aiohttp
-from aioresponses import aioresponses
-from asynctest import TestCase, patch, CoroutineMock
+from aioresponses import CallbackResult, aioresponses
 
 import aiompesa
 
 CONSUMER_KEY = "nF4OwB2XiuYZwmdMz3bovnzw2qMls1b7"
 CONSUMER_SECRET = "biIImmaAX9dYD4Pw"
 SAF_BASE_URL = aiompesa.Mpesa.SANDBOX_BASE_URL
+ENDPOINTS = {
+    "token": f"{SAF_BASE_URL}{aiompesa.Mpesa.GENERATE_TOKEN_PATH}",
+    "register_url": f"{SAF_BASE_URL}{aiompesa.Mpesa.REGISTER_URL_PATH}",
+    "c2b": f"{SAF_BASE_URL}{aiompesa.Mpesa.C2B_URL_PATH}",
+    "b2c": f"{SAF_BASE_URL}{aiompesa.Mpesa.B2C_URL_PATH}",
+    "b2b": f"{SAF_BASE_URL}{aiompesa.Mpesa.B2B_URL_PATH}",
+    "stk_push": f"{SAF_BASE_URL}{aiompesa.Mpesa.STK_URL_PATH}",
+    "reversal": f"{SAF_BASE_URL}{aiompesa.Mpesa.REVERSAL_URL_PATH}",
+}
+URL = "https://example.com/test"
+
+
+@pytest.fixture(scope="session")
+def security_cipher():
+    return aiompesa.Mpesa.generate_security_credential(
+        "examples/cert.cer", "test_pass"
+    )
 
 
-def AsyncMock(*args, **kwargs):
-    """
-    see: https://blog.miguelgrinberg.com/post/unit-testing-asyncio-code
-    """
-    m = mock.MagicMock(*args, **kwargs)
-
-    async def mock_coro(*args, **kwargs):
-        return m(*args, **kwargs)
-
-    mock_coro.mock = m
-    return mock_coro
-
-
-class TestMpesa(TestCase):
-    @staticmethod
-    def _run(coro):
-        """Helper function that runs any coroutine in an event loop and passes
-        its return value back to the caller.
-        https://blog.miguelgrinberg.com/post/unit-testing-asyncio-code
-        """
-        loop = asyncio.get_event_loop()
-        return loop.run_until_complete(coro)
-
-    def setUp(self):
-        self.mpesa = aiompesa.Mpesa(
-            consumer_key=CONSUMER_KEY, consumer_secret=CONSUMER_SECRET
-        )
-        self.prod_mpesa = aiompesa.Mpesa(
-            sandbox=False,
-            consumer_key=CONSUMER_KEY,
-            consumer_secret=CONSUMER_SECRET,
-        )
-        self.fake_mpesa = aiompesa.Mpesa(False, "fake_key", "fake_secret")
-        self.url = "https://example.com/test"
-
-    def test_sandbox_setup(self):
-        self.assertEqual(
-            self.prod_mpesa.base_url, self.mpesa.PRODUCTION_BASE_URL
-        )
-        self.assertEqual(self.mpesa.base_url, self.mpesa.SANDBOX_BASE_URL)
-
-    def test_get(self):
-        session = AsyncMock(return_value=mock.Mock())
-        self.mpesa.get = AsyncMock(return_value={"success": True})
-        self._run(self.mpesa.get(session, self.url))
-        self.mpesa.get.mock.assert_called_once_with(session, self.url)
-
-    @patch("aiohttp.ClientSession.get")
-    async def test_get_returns_error_dict_after_json_serialize_fails(
-        self, req
-    ):
-        session = aiohttp.ClientSession()
-        req.return_value.__aenter__.return_value.json = CoroutineMock(
-            side_effect=Exception("Error serializing text to json")
-        )
-        req.return_value.__aenter__.return_value.status = 200
-        res = await self.mpesa.get(session, self.url)
-        self.assertEqual(req.call_count, 1)
-        self.assertDictEqual(
-            res, {"error": "Error serializing text to json", "status": 200}
-        )
-
-    def test_generate_password(self):
-        password, timestamp = self.mpesa.generate_password("123234", "xxxyyyy")
-        self.assertIsInstance(password, str)
-        self.assertIsInstance(timestamp, str)
-
-    def test_generate_token_fails(self):
-        self.mpesa.get = AsyncMock(return_value=dict(error=True))
-        with aioresponses():
-            res = self._run(self.mpesa.generate_token())
-            self.assertDictEqual(
-                res, {"access_token": None, "expires_in": None}
-            )
+@pytest.fixture(scope="module")
+def _aioresponses():
+    with aioresponses() as mocked:
+        yield mocked
+
+
+@pytest.fixture
+def mocked(_aioresponses):
+    """The module's aioresponses, with this test's responses removed after."""
+    yield _aioresponses
+    _aioresponses.clear()
+    _aioresponses.requests.clear()
 
-    def test_generate_token(self):
-        self.mpesa.get = AsyncMock(
-            return_value=dict(access_token="access_token", expires_in="3600")
-        )
-        with aioresponses():
-            res = self._run(self.mpesa.generate_token())
-            self.assertDictEqual(
-                res, {"access_token": "access_token", "expires_in": "3600"}
-            )
 
-    @mock.patch(
-        "aiompesa.Mpesa.generate_token",
-        AsyncMock(return_value={"access_token": "access_token"}),
+# Tests fill the token cache of `mpesa` and close its session, so each test
+# gets a fresh instance, while the read-only instances below are shared.
+@pytest.fixture
+async def mpesa():
+    mpesa = aiompesa.Mpesa(
+        consumer_key=CONSUMER_KEY, consumer_secret=CONSUMER_SECRET
     )
-    def test_get_headers(self):
-        headers = self._run(self.mpesa._get_headers())
-        self.assertIsInstance(headers, dict)
+    yield mpesa
+    await mpesa.aclose()
 
-    @mock.patch(
-        "aiompesa.Mpesa.generate_token",
-        AsyncMock(return_value={"access_token": None}),
+
+@pytest.fixture(scope="module")
+async def prod_mpesa():
+    mpesa = aiompesa.Mpesa(
+        sandbox=False,
+        consumer_key=CONSUMER_KEY,
+        consumer_secret=CONSUMER_SECRET,
     )
-    def test_get_headers_fails(self):
-        with pytest.raises(ValueError):
-            self._run(self.fake_mpesa._get_headers())
+    yield mpesa
+    await mpesa.aclose()
 
-    def test_generate_security_credential(self):
-        cipher = self.mpesa.generate_security_credential(
-            "examples/cert.cer", "test_pass"
-        )
-        self.assertIsInstance(cipher, bytes)
 
-    def test_generate_security_credential_raises(self):
-        with pytest.raises(FileNotFoundError):
-            self.mpesa.generate_security_credential("fake/", "faketoo")
+@pytest.fixture(scope="module")
+async def fake_mpesa():
+    mpesa = aiompesa.Mpesa(False, "fake_key", "fake_secret")
+    yield mpesa
+    await mpesa.aclose()
 
-    def test_register_url_wrong_command_id(self):
-        with pytest.raises(ValueError):
-            self._run(self.mpesa.register_url("fake_type", "", "", ""))
 
-    def test_register_url_wrong_callback_url(self):
-        with pytest.raises(ValueError):
-            self._run(
-                self.mpesa.register_url("Completed", "123123", "fake_url", "")
-            )
+def test_sandbox_setup(mpesa, prod_mpesa):
+    assert prod_mpesa.base_url == mpesa.PRODUCTION_BASE_URL
+    assert mpesa.base_url == mpesa.SANDBOX_BASE_URL
 
-    def test_register_url_wrong_results_url(self):
-        with pytest.raises(ValueError):
-            self._run(
-                self.mpesa.register_url(
-                    "Completed",
-                    "123123",
-                    "https://good.com/callback",
-                    "fake_url",
-                )
-            )
 
-    @mock.patch(
-        "aiompesa.Mpesa._get_headers",
-        AsyncMock(return_value={"Content-Type": "application/json"}),
-    )
-    def test_register_url(self):
-        with aioresponses() as mo:
-            mo.post(
-                f"{SAF_BASE_URL}/mpesa/c2b/v1/registerurl",
-                payload={"success": True},
-            )
+def test_limit():
+    assert aiompesa.Mpesa(limit=5).limit == 5
+    with mock.patch.dict(os.environ, {"AIOMPESA_LIMIT": "7"}):
+        assert aiompesa.Mpesa().limit == 7
 
-            response = self._run(
-                self.mpesa.register_url(
-                    "Completed",
-                    "123123",
-                    "https://good.com/callback",
-                    "https://good.com/callback",
-                )
-            )
-            self.assertDictEqual(response, {"success": True})
-
-    def test_post(self):
-        session = AsyncMock(return_value=mock.Mock())
-        self.mpesa.post = AsyncMock(return_value={"success": True})
-        self._run(self.mpesa.post(session, self.url, data={"data": True}))
-        self.mpesa.post.mock.assert_called_once_with(
-            session, self.url, data={"data": True}
-        )
-
-    @patch("aiohttp.ClientSession.post")
-    async def test_post_returns_error_dict_after_json_serialize_fails(
-        self, req
-    ):
-        session = aiohttp.ClientSession()
-        req.return_value.__aenter__.return_value.json = CoroutineMock(
-            side_effect=Exception("Error serializing text to json")
-        )
-        req.return_value.__aenter__.return_value.status = 200
-        res = await self.mpesa.post(session, self.url, data={"data": True})
-        self.assertEqual(req.call_count, 1)
-        self.assertDictEqual(
-            res, {"error": "Error serializing text to json", "status": 200}
-        )
-
-    def test_c2b_invalid_phone(self):
+
+@pytest.mark.parametrize("limit", [0, -1])
+def test_limit_must_be_positive(limit):
+    with pytest.raises(ValueError):
+        aiompesa.Mpesa(limit=limit)
+    with mock.patch.dict(os.environ, {"AIOMPESA_LIMIT": f"{limit}"}):
         with pytest.raises(ValueError):
-            self._run(self.mpesa.c2b("123123", 100, "0731100100"))
+            aiompesa.Mpesa()
+
 
-    @mock.patch(
-        "aiompesa.Mpesa._get_headers",
-        AsyncMock(return_value={"Content-Type": "application/json"}),
+def test_instance_is_not_bound_to_a_loop(mocked):
+    """Test an instance made outside of a loop works on the one running it."""
+    mocked.get(
+        ENDPOINTS["token"],
+        payload=dict(access_token="a", expires_in="3599"),
     )
-    def test_c2b(self):
-        with aioresponses() as mo:
-            mo.post(
-                f"{SAF_BASE_URL}/mpesa/c2b/v1/simulate",
-                payload={"success": True},
+    mocked.post(ENDPOINTS["c2b"], payload={"success": True}, repeat=True)
+
+    async def simulate(mpesa):
+        try:
+            return await asyncio.gather(
+                *(mpesa.c2b("123123", 100, "0721100100") for _ in range(3))
             )
+        finally:
+            await mpesa.aclose()
+
+    with ThreadPoolExecutor(1) as executor:
+        mpesa = executor.submit(
+            aiompesa.Mpesa, True, CONSUMER_KEY, CONSUMER_SECRET, 1
+        ).result()
+        responses = executor.submit(asyncio.run, simulate(mpesa)).result()
+    assert responses == [{"success": True}] * 3
+
+
+def test_instance_is_reused_across_loops(mocked):
+    """Test the locks of an instance are not bound to the first loop."""
+    mocked.get(
+        ENDPOINTS["token"],
+        payload=dict(access_token="a", expires_in="3599"),
+    )
 
-            response = self._run(self.mpesa.c2b("123123", 100, "0721100100"))
-            self.assertDictEqual(response, {"success": True})
+    async def respond(url, **_):
+        await asyncio.sleep(0)
+        return CallbackResult(payload={"success": True})
 
-    def test_b2c_invalid_party_b(self):
-        with pytest.raises(ValueError):
-            self._run(
-                self.mpesa.b2c(
-                    initiator_name="tester",
-                    security_credential="xxx",
-                    command_id="Wrong",
-                    amount=100,
-                    party_a="123123",
-                    party_b="0731123123",
-                    remarks="test",
-                    queue_timeout_url="https://test.mpesa/",
-                    result_url="https://tested.mpesa",
-                )
-            )
+    mocked.post(ENDPOINTS["c2b"], callback=respond, repeat=True)
+    mpesa = aiompesa.Mpesa(True, CONSUMER_KEY, CONSUMER_SECRET, limit=2)
+    request = dict(shortcode="123123", amount=100, phone_number="0721100100")
 
-    def test_b2c_invalid_command_id(self):
-        with pytest.raises(ValueError):
-            self._run(
-                self.mpesa.b2c(
-                    initiator_name="tester",
-                    security_credential="xxx",
-                    command_id="Wrong",
-                    amount=100,
-                    party_a="123123",
-                    party_b="0721123123",
-                    remarks="test",
-                    queue_timeout_url="https://test.mpesa/",
-                    result_url="https://tested.mpesa",
-                )
-            )
+    async def simulate():
+        async with mpesa:
+            return await mpesa.c2b_many([request] * 6)
 
-    @mock.patch(
-        "aiompesa.Mpesa._get_headers",
-        AsyncMock(return_value={"Content-Type": "application/json"}),
-    )
-    def test_b2c(self):
-        with aioresponses() as mo:
-            mo.post(
-                f"{SAF_BASE_URL}/mpesa/b2c/v1/paymentrequest",
-                payload={"success": True},
-            )
+    with ThreadPoolExecutor(1) as executor:
+        for _ in range(2):
+            responses = executor.submit(asyncio.run, simulate()).result()
+            assert responses == [{"success": True}] * 6
 
-            response = self._run(
-                self.mpesa.b2c(
-                    initiator_name="tester",
-                    security_credential="xxx",
-                    command_id="SalaryPayment",
-                    amount=100,
-                    party_a="123123",
-                    party_b="0721123123",
-                    remarks="test",
-                    queue_timeout_url="https://test.mpesa/",
-                    result_url="https://tested.mpesa",
-                )
-            )
-            self.assertDictEqual(response, {"success": True})
 
-    def test_b2b_invalid_party_b(self):
-        with pytest.raises(ValueError):
-            self._run(
-                self.mpesa.b2b(
-                    initiator_name="tester",
-                    security_credential="xxx",
-                    command_id="Wrong",
-                    amount=100,
-                    party_a="123123",
-                    party_b="0731123123",
-                    remarks="test",
-                    queue_timeout_url="https://test.mpesa/",
-                    result_url="https://tested.mpesa",
-                )
-            )
+async def test_rps():
+    mpesa = aiompesa.Mpesa(rps=2)
+    with mock.patch("asyncio.sleep", mock.AsyncMock()) as sleep:
+        for _ in range(3):
+            await mpesa._throttle()
+    sleep.assert_awaited_once()
+    assert sleep.await_args[0][0] > 0
 
-    def test_b2b_invalid_command_id(self):
-        with pytest.raises(ValueError):
-            self._run(
-                self.mpesa.b2c(
-                    initiator_name="tester",
-                    security_credential="xxx",
-                    command_id="Wrong",
-                    amount=100,
-                    party_a="123123",
-                    party_b="0721123123",
-                    remarks="test",
-                    queue_timeout_url="https://test.mpesa/",
-                    result_url="https://tested.mpesa",
-                )
-            )
 
-    @mock.patch(
-        "aiompesa.Mpesa._get_headers",
-        AsyncMock(return_value={"Content-Type": "application/json"}),
+@pytest.mark.parametrize("rps", [0, -1])
+def test_rps_must_be_positive(rps):
+    with pytest.raises(ValueError):
+        aiompesa.Mpesa(rps=rps)
+
+
+async def test_rps_covers_retries(mocked):
+    """Test every retry of a rate limited request takes a token."""
+    mocked.get(
+        ENDPOINTS["token"],
+        payload=dict(access_token="a", expires_in="3599"),
     )
-    def test_b2b(self):
-        with aioresponses() as mo:
-            mo.post(
-                f"{SAF_BASE_URL}/mpesa/b2b/v1/paymentrequest",
-                payload={"success": True},
-            )
-            response = self._run(
-                self.mpesa.b2b(
-                    initiator_name="tester",
-                    security_credential="xxx",
-                    command_id="BusinessBuyGoods",
-                    amount=100,
-                    party_a="123123",
-                    party_b="0721123123",
-                    remarks="test",
-                    queue_timeout_url="https://test.mpesa/",
-                    result_url="https://tested.mpesa",
-                )
-            )
-            self.assertDictEqual(response, {"success": True})
+    mocked.post(ENDPOINTS["c2b"], status=429, headers={"Retry-After": "0"})
+    mocked.post(ENDPOINTS["c2b"], payload={"success": True})
+    async with aiompesa.Mpesa(
+        consumer_key=CONSUMER_KEY, consumer_secret=CONSUMER_SECRET, rps=10
+    ) as mpesa:
+        with mock.patch.object(mpesa, "_throttle", mock.AsyncMock()) as t:
+            response = await mpesa.c2b("123123", 100, "0721100100")
+    assert response == {"success": True}
+    assert t.await_count == 3
+
+
+async def test_timeout():
+    timeout = aiohttp.ClientTimeout(total=5)
+    mpesa = aiompesa.Mpesa(timeout=timeout)
+    session = await mpesa._get_session()
+    assert session.timeout is timeout
+    await mpesa.aclose()
+
+
+async def test_connector_kwargs():
+    mpesa = aiompesa.Mpesa(connector_kwargs={"limit_per_host": 5})
+    session = await mpesa._get_session()
+    assert session.connector.limit_per_host == 5
+    assert session.connector.limit == mpesa.limit
+    await mpesa.aclose()
+
+
+async def test_session_is_reused(mpesa):
+    session = await mpesa._get_session()
+    assert await mpesa._get_session() is session
+    await mpesa.aclose()
+    assert session.closed
+    assert mpesa._session is None
+
+
+def test_session_is_replaced_on_another_loop(caplog):
+    """Test a session left open by an earlier loop is not reused.
+
+    The old session cannot be closed once its loop is gone, so aiohttp is
+    expected to warn that it was left unclosed.
+    """
+    mpesa = aiompesa.Mpesa()
+
+    async def replace(session):
+        try:
+            return await mpesa._get_session() is not session
+        finally:
+            await mpesa.aclose()
+
+    with ThreadPoolExecutor(1) as executor:
+        session = executor.submit(asyncio.run, mpesa._get_session()).result()
+        with pytest.warns(ResourceWarning, match="Unclosed client session"):
+            assert executor.submit(asyncio.run, replace(session)).result()
+            del session
+            gc.collect()
+    assert "closed event loop" in caplog.text
+
+
+def test_session_is_closed_on_its_open_loop():
+    """Test a replaced session is closed on its loop while that still runs."""
+    mpesa = aiompesa.Mpesa()
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    try:
+        session = asyncio.run_coroutine_threadsafe(
+            mpesa._get_session(), loop
+        ).result()
+
+        async def replace():
+            try:
+                return await mpesa._get_session() is not session
+            finally:
+                await mpesa.aclose()
+
+        with ThreadPoolExecutor(1) as executor:
+            assert executor.submit(asyncio.run, replace()).result()
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0.01), loop).result()
+        assert session.closed
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+async def test_close(mpesa):
+    session = await mpesa._get_session()
+    await mpesa.close()
+    assert session.closed
+
+
+async def test_context_manager_closes_session():
+    async with aiompesa.Mpesa() as mpesa:
+        session = mpesa._session
+        assert not session.closed
+    assert session.closed
+
+
+@mock.patch.object(
+    aiompesa.Mpesa,
+    "get",
+    new_callable=mock.AsyncMock,
+    return_value={"success": True},
+)
+async def test_get(get, mpesa):
+    session = object()
+    await mpesa.get(session, URL)
+    get.assert_awaited_once_with(session, URL)
+
+
+@mock.patch("aiohttp.ClientSession.get")
+async def test_get_returns_error_dict_after_json_serialize_fails(req, mpesa):
+    response = req.return_value.__aenter__.return_value
+    response.read = mock.AsyncMock(
+        return_value=b"Error serializing text to json"
+    )
+    response.status = 200
+    response.content_type = "application/json"
+    async with aiohttp.ClientSession() as session:
+        res = await mpesa.get(session, URL)
+    assert req.call_count == 1
+    assert res["status"] == 200
+    assert "error" in res
+
+
+@mock.patch("aiohttp.ClientSession.get")
+async def test_get_returns_error_dict_for_non_json_response(req, mpesa):
+    response = req.return_value.__aenter__.return_value
+    response.content_type = "text/html"
+    response.read = mock.AsyncMock(return_value=b"Service Unavailable")
+    response.status = 503
+    response.headers = {"Retry-After": "0"}
+    async with aiohttp.ClientSession() as session:
+        res = await mpesa.get(session, URL)
+    assert res == {"error": "Service Unavailable", "status": 503}
+    response.json.assert_not_called()
+
+
+@pytest.mark.parametrize("body", [b"null", b"[1, 2]"])
+async def test_get_returns_error_dict_for_non_object_json(mpesa, mocked, body):
+    mocked.get(URL, body=body, content_type="application/json")
+    async with aiohttp.ClientSession() as session:
+        res = await mpesa.get(session, URL)
+    assert res == {"error": body.decode(), "status": 200}
+
+
+async def test_generate_token_fails_on_non_object_json(mpesa, mocked):
+    mocked.get(
+        ENDPOINTS["token"], body=b"null", content_type="application/json"
+    )
+    res = await mpesa.generate_token()
+    assert res == {"access_token": None, "expires_in": None}
+
+
+def test_generate_password(mpesa):
+    password, timestamp = mpesa.generate_password("123234", "xxxyyyy")
+    assert isinstance(password, str)
+    assert isinstance(timestamp, str)
+
+
+@mock.patch.object(
+    aiompesa.Mpesa,
+    "get",
+    new_callable=mock.AsyncMock,
+    return_value=dict(error=True),
+)
+async def test_generate_token_fails(get, mpesa, mocked):
+    res = await mpesa.generate_token()
+    assert res == {"access_token": None, "expires_in": None}
+
+
+@mock.patch.object(
+    aiompesa.Mpesa,
+    "get",
+    new_callable=mock.AsyncMock,
+    return_value=dict(errorCode="500.001.1001", errorMessage="Error"),
+)
+async def test_generate_token_fails_on_error_body(get, mpesa):
+    res = await mpesa.generate_token()
+    assert res == {"access_token": None, "expires_in": None}
+    assert mpesa._token is None
+
+
+@mock.patch.object(
+    aiompesa.Mpesa,
+    "get",
+    new_callable=mock.AsyncMock,
+    return_value=dict(access_token="access_token", expires_in="3600"),
+)
+async def test_generate_token(get, mpesa, mocked):
+    res = await mpesa.generate_token()
+    assert res == {"access_token": "access_token", "expires_in": "3600"}
+
+
+@mock.patch.object(
+    aiompesa.Mpesa,
+    "get",
+    new_callable=mock.AsyncMock,
+    return_value=dict(access_token="access_token", expires_in="3600"),
+)
+async def test_generate_token_is_cached(get, mpesa):
+    await mpesa.generate_token()
+    res = await mpesa.generate_token()
+    assert res["access_token"] == "access_token"
+    assert get.await_count == 1
+
+
+@pytest.mark.parametrize(
+    "expires_in,cached", [("3599.5", True), ("soon", False), (None, False)]
+)
+async def test_generate_token_parses_expires_in(mpesa, expires_in, cached):
+    response = dict(access_token="access_token", expires_in=expires_in)
+    with mock.patch.object(
+        aiompesa.Mpesa, "get", mock.AsyncMock(return_value=response)
+    ):
+        res = await mpesa.generate_token()
+    assert res["access_token"] == "access_token"
+    assert mpesa._token_is_valid() is cached
 
-    def test_stk_push_invalid_party_b(self):
-        with pytest.raises(ValueError):
-            self._run(
-                self.mpesa.stk_push(
-                    lipa_na_mpesa_shortcode="123123",
-                    lipa_na_mpesa_passkey="xxx",
-                    amount=100,
-                    party_a="123123",
-                    party_b="0731123123",
-                    callback_url="https://results.back/",
-                    transaction_desc="test",
-                )
-            )
 
-    @mock.patch(
-        "aiompesa.Mpesa.generate_password",
-        mock.MagicMock(return_value=("axsaxa", "20180901349134")),
+@mock.patch(
+    "aiompesa.Mpesa.generate_token",
+    mock.AsyncMock(return_value={"access_token": "access_token"}),
+)
+async def test_get_headers(mpesa):
+    headers = await mpesa._get_headers()
+    assert isinstance(headers, dict)
+
+
+@mock.patch(
+    "aiompesa.Mpesa.generate_token",
+    mock.AsyncMock(return_value={"access_token": None}),
+)
+async def test_get_headers_fails(fake_mpesa):
+    with pytest.raises(ValueError):
+        await fake_mpesa._get_headers()
+
+
+def test_load_public_key_skips_pem_preamble():
+    with open("examples/cert.cer", "rb") as f:
+        cert_data = f.read()
+    preamble = b"Bag Attributes\n    friendlyName: sandbox\n"
+    key = aiompesa.mpesa._load_public_key(preamble + cert_data)
+    expected = aiompesa.mpesa._load_public_key(cert_data)
+    assert key.public_numbers() == expected.public_numbers()
+
+
+@pytest.mark.slow
+def test_generate_security_credential(security_cipher):
+    assert isinstance(security_cipher, str)
+
+
+@pytest.mark.slow
+async def test_generate_security_credentials(mpesa):
+    ciphers = await mpesa.generate_security_credentials(
+        "examples/cert.cer", ["test_pass", "other_pass"]
     )
-    @mock.patch(
-        "aiompesa.Mpesa._get_headers",
-        AsyncMock(return_value={"Content-Type": "application/json"}),
+    assert len(ciphers) == 2
+    assert all(isinstance(c, str) for c in ciphers)
+
+
+def test_generate_security_credential_raises(mpesa):
+    with pytest.raises(FileNotFoundError):
+        mpesa.generate_security_credential("fake/", "faketoo")
+
+
+PAYMENT = dict(
+    initiator_name="tester",
+    security_credential="xxx",
+    amount=100,
+    party_a="123123",
+    remarks="test",
+    queue_timeout_url="https://test.mpesa/",
+    result_url="https://tested.mpesa",
+)
+
+
+@pytest.mark.parametrize(
+    "method,args,kwargs",
+    [
+        ("register_url", ("fake_type", "", "", ""), {}),
+        ("register_url", ("Completed", "123123", "fake_url", ""), {}),
+        (
+            "register_url",
+            ("Completed", "123123", "https://good.com/callback", "fake_url"),
+            {},
+        ),
+        ("c2b", ("123123", 100, "0731100100"), {}),
+        (
+            "c2b_many",
+            (
+                [
+                    dict(
+                        shortcode="123123",
+                        amount=100,
+                        phone_number="0721100100",
+                    ),
+                    dict(
+                        shortcode="123123",
+                        amount=100,
+                        phone_number="0731100100",
+                    ),
+                ],
+            ),
+            {},
+        ),
+        (
+            "b2c",
+            (),
+            dict(PAYMENT, command_id="SalaryPayment", party_b="0731123123"),
+        ),
+        ("b2c", (), dict(PAYMENT, command_id="Wrong", party_b="0721123123")),
+        (
+            "b2c_many",
+            ([dict(command_id="SalaryPayment", party_b="0731100100")],),
+            {},
+        ),
+        ("b2b", (), dict(PAYMENT, command_id="Wrong", party_b="0721123123")),
+        (
+            "stk_push",
+            (),
+            dict(
+                lipa_na_mpesa_shortcode="123123",
+                lipa_na_mpesa_passkey="xxx",
+                amount=100,
+                party_a="123123",
+                party_b="0731123123",
+                callback_url="https://results.back/",
+                transaction_desc="test",
+            ),
+        ),
+    ],
+    ids=[
+        "register_url_wrong_command_id",
+        "register_url_wrong_callback_url",
+        "register_url_wrong_results_url",
+        "c2b_invalid_phone",
+        "c2b_many_invalid_phone",
+        "b2c_invalid_party_b",
+        "b2c_invalid_command_id",
+        "b2c_many_invalid_party_b",
+        "b2b_invalid_command_id",
+        "stk_push_invalid_party_a",
+    ],
+)
+async def test_validation_errors(mpesa, method, args, kwargs):
+    with pytest.raises(ValueError):
+        await getattr(mpesa, method)(*args, **kwargs)
+
+
+async def test_rejected_token_is_refreshed(mpesa, mocked):
+    token_url = ENDPOINTS["token"]
+    c2b_url = ENDPOINTS["c2b"]
+    mocked.get(token_url, payload=dict(access_token="a", expires_in="3599"))
+    mocked.get(token_url, payload=dict(access_token="b", expires_in="3599"))
+    mocked.post(c2b_url, status=401, payload={"errorCode": "404.001.03"})
+    mocked.post(c2b_url, payload={"success": True})
+    response = await mpesa.c2b("123123", 100, "0721100100")
+    assert response == {"success": True}
+    assert mpesa._token == "b"
+
+
+@mock.patch.object(
+    aiompesa.Mpesa,
+    "post",
+    new_callable=mock.AsyncMock,
+    return_value={"success": True},
+)
+async def test_post(post, mpesa):
+    session = object()
+    await mpesa.post(session, URL, data={"data": True})
+    post.assert_awaited_once_with(session, URL, data={"data": True})
+
+
+@mock.patch("aiohttp.ClientSession.post")
+async def test_post_returns_error_dict_after_json_serialize_fails(req, mpesa):
+    response = req.return_value.__aenter__.return_value
+    response.read = mock.AsyncMock(
+        return_value=b"Error serializing text to json"
+    )
+    response.status = 200
+    response.content_type = "application/json"
+    async with aiohttp.ClientSession() as session:
+        res = await mpesa.post(session, URL, data={"data": True})
+    assert req.call_count == 1
+    assert res["status"] == 200
+    assert "error" in res
+
+
+async def test_post_retries_rate_limited_responses(mpesa, mocked):
+    mocked.post(URL, status=429, headers={"Retry-After": "0"})
+    mocked.post(URL, payload={"success": True})
+    async with aiohttp.ClientSession() as session:
+        response = await mpesa.post(session, URL, data={"data": True})
+    assert response == {"success": True}
+
+
+async def test_get_retries_gateway_errors(mpesa, mocked):
+    mocked.get(URL, status=502)
+    mocked.get(URL, payload={"success": True})
+    async with aiohttp.ClientSession() as session:
+        response = await mpesa.get(session, URL)
+    assert response == {"success": True}
+
+
+async def test_payments_are_not_retried_after_gateway_errors(mpesa, mocked):
+    """Test a 504 to a payment is returned rather than paid out again."""
+    mocked.get(
+        ENDPOINTS["token"],
+        payload=dict(access_token="a", expires_in="3599"),
+    )
+    mocked.post(ENDPOINTS["b2b"], status=504, payload={"error": "timeout"})
+    mocked.post(ENDPOINTS["b2b"], payload={"success": True})
+    response = await mpesa.b2b(
+        "tester", "xxx", "BusinessPayBill", 100, "123123", "600000"
+    )
+    assert response == {"error": "timeout"}
+    requests = {
+        verb: len(calls) for (verb, _), calls in mocked.requests.items()
+    }
+    assert requests == {"GET": 1, "POST": 1}
+
+
+async def test_retry_after_is_capped(mpesa, mocked):
+    mocked.post(URL, status=429, headers={"Retry-After": "3600"})
+    mocked.post(URL, payload={"success": True})
+    async with aiohttp.ClientSession() as session:
+        with mock.patch("asyncio.sleep", mock.AsyncMock()) as sleep:
+            response = await mpesa.post(session, URL, data={"data": True})
+    assert response == {"success": True}
+    sleep.assert_awaited_once_with(mpesa.MAX_RETRY_DELAY)
+
+
+@pytest.mark.parametrize("retry_after", ["nan", "inf", "-1"])
+async def test_invalid_retry_after_backs_off(mpesa, mocked, retry_after):
+    mocked.post(URL, status=429, headers={"Retry-After": retry_after})
+    mocked.post(URL, payload={"success": True})
+    async with aiohttp.ClientSession() as session:
+        with mock.patch("asyncio.sleep", mock.AsyncMock()) as sleep:
+            response = await mpesa.post(session, URL, data={"data": True})
+    assert response == {"success": True}
+    sleep.assert_awaited_once_with(0.1)
+
+
+async def test_retry_settings_can_be_overridden(mocked):
+    class Mpesa(aiompesa.Mpesa):
+        MAX_RETRIES = 1
+
+    mocked.get(URL, status=502, repeat=True)
+    async with aiohttp.ClientSession() as session:
+        with mock.patch("asyncio.sleep", mock.AsyncMock()):
+            response = await Mpesa.get(session, URL)
+    assert response["status"] == 502
+    requests = {
+        verb: len(calls) for (verb, _), calls in mocked.requests.items()
+    }
+    assert requests == {"GET": 2}
+
+
+@pytest.mark.parametrize(
+    "method,endpoint,kwargs",
+    [
+        (
+            "c2b_many",
+            "c2b",
+            dict(shortcode="123123", amount=100, phone_number="0721100100"),
+        ),
+        (
+            "b2c_many",
+            "b2c",
+            dict(
+                initiator_name="tester",
+                security_credential="xxx",
+                command_id="SalaryPayment",
+                amount=100,
+                party_a="123123",
+                party_b="0721123123",
+                remarks="test",
+                queue_timeout_url="https://test.mpesa/",
+                result_url="https://tested.mpesa",
+            ),
+        ),
+        (
+            "stk_push_many",
+            "stk_push",
+            dict(
+                lipa_na_mpesa_shortcode="123123",
+                lipa_na_mpesa_passkey="xxx",
+                amount=100,
+                party_a="0721123123",
+                party_b="123123",
+                callback_url="https://results.back/",
+                transaction_desc="test",
+            ),
+        ),
+    ],
+    ids=["c2b", "b2c", "stk_push"],
+)
+async def test_many_shares_one_token(mocked, method, endpoint, kwargs):
+    """Test a batch fetches one token and keeps `limit` requests in flight."""
+    mocked.get(
+        ENDPOINTS["token"],
+        payload=dict(access_token="a", expires_in="3599"),
+    )
+    in_flight = peak = 0
+
+    async def respond(url, **_):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0)
+        in_flight -= 1
+        return CallbackResult(payload={"success": True})
+
+    mocked.post(ENDPOINTS[endpoint], callback=respond, repeat=True)
+    async with aiompesa.Mpesa(
+        consumer_key=CONSUMER_KEY, consumer_secret=CONSUMER_SECRET, limit=2
+    ) as mpesa:
+        responses = await getattr(mpesa, method)([kwargs] * 5)
+    assert responses == [{"success": True}] * 5
+    requests = {
+        verb: len(calls) for (verb, _), calls in mocked.requests.items()
+    }
+    assert requests == {"GET": 1, "POST": 5}
+    assert peak == 2
+
+
+def test_c2b_payload(mpesa):
+    payload = mpesa.c2b_payload("123123", 100, "0721100100")
+    assert isinstance(payload, bytes)
+    assert mpesa.c2b_payload("123123", 100, "0721100100") is payload
+    assert b'"Amount":"100.0"' in mpesa.c2b_payload(
+        "123123", 100.0, "0721100100"
     )
-    def test_stk_push_valid(self):
-        with aioresponses() as mo:
-            mo.post(
-                f"{SAF_BASE_URL}/mpesa/stkpush/v1/processrequest",
-                payload={"success": True},
-            )
 
-            response = self._run(
-                self.mpesa.stk_push(
-                    lipa_na_mpesa_shortcode="123123",
-                    lipa_na_mpesa_passkey="xxx",
-                    amount=100,
-                    party_a="0721123123",
-                    party_b="123123",
-                    callback_url="https://results.back/",
-                    transaction_desc="test",
-                )
-            )
-            self.assertDictEqual(response, {"success": True})
 
-    @mock.patch(
-        "aiompesa.Mpesa._get_headers",
-        AsyncMock(return_value={"Content-Type": "application/json"}),
+@mock.patch(
+    "aiompesa.Mpesa.generate_password",
+    mock.MagicMock(return_value=("axsaxa", "20180901349134")),
+)
+@mock.patch(
+    "aiompesa.Mpesa._get_headers",
+    mock.AsyncMock(return_value={"Content-Type": "application/json"}),
+)
+async def test_all_happy_paths(mpesa, mocked):
+    names = ["register_url", "c2b", "b2c", "b2b", "stk_push", "reversal"]
+    for name in names:
+        mocked.post(ENDPOINTS[name], payload={"success": name})
+
+    responses = await asyncio.gather(
+        mpesa.register_url(
+            "Completed",
+            "123123",
+            "https://good.com/callback",
+            "https://good.com/callback",
+        ),
+        mpesa.c2b("123123", 100, "0721100100"),
+        mpesa.b2c(
+            initiator_name="tester",
+            security_credential="xxx",
+            command_id="SalaryPayment",
+            amount=100,
+            party_a="123123",
+            party_b="0721123123",
+            remarks="test",
+            queue_timeout_url="https://test.mpesa/",
+            result_url="https://tested.mpesa",
+        ),
+        mpesa.b2b(
+            initiator_name="tester",
+            security_credential="xxx",
+            command_id="BusinessBuyGoods",
+            amount=100,
+            party_a="123123",
+            party_b="0721123123",
+            remarks="test",
+            queue_timeout_url="https://test.mpesa/",
+            result_url="https://tested.mpesa",
+        ),
+        mpesa.stk_push(
+            lipa_na_mpesa_shortcode="123123",
+            lipa_na_mpesa_passkey="xxx",
+            amount=100,
+            party_a="0721123123",
+            party_b="123123",
+            callback_url="https://results.back/",
+            transaction_desc="test",
+        ),
+        mpesa.reversal(
+            initiator="tester",
+            security_credential="xxx",
+            transaction_id="AERW90348NFSD",
+            amount=100,
+            receiver_party="0721123123",
+            occasion="0721123123",
+            remarks="test",
+            queue_timeout_url="https://test.mpesa/",
+            result_url="https://tested.mpesa",
+        ),
     )
-    def test_reversal(self):
-        with aioresponses() as mo:
-            mo.post(
-                f"{SAF_BASE_URL}/mpesa/reversal/v1/request",
-                payload={"success": True},
-            )
-            response = self._run(
-                self.mpesa.reversal(
-                    initiator="tester",
-                    security_credential="xxx",
-                    transaction_id="AERW90348NFSD",
-                    amount=100,
-                    receiver_party="0721123123",
-                    occasion="0721123123",
-                    remarks="test",
-                    queue_timeout_url="https://test.mpesa/",
-                    result_url="https://tested.mpesa",
-                )
-            )
-            self.assertDictEqual(response, {"success": True})
+    assert responses == [{"success": name} for name in names]
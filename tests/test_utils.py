@@ -1,10 +1,12 @@
 import random
+import re
+import time
+from unittest import mock
+
 import pytest
 
 from aiompesa import utils
 
-random.seed(999999)
-
 
 def test_raises_value_error():
     """Test raising the Exception."""
@@ -20,9 +22,42 @@ def test_isurl():
         "https://test.com/valid_path/",
         "https://www.test.com/valid_path/",
     ]
-    for url in valid_urls:
-        valid = utils.is_url(url)
-        assert valid is True
+    assert utils.is_url_many(valid_urls) == [True] * len(valid_urls)
+
+
+def test_isurl_does_not_compile() -> None:
+    """Test is_url reuses the module's compiled pattern on every call."""
+    assert isinstance(utils._URL_RE, re.Pattern)
+    is_url = utils._is_url.__wrapped__
+    # `re.match` and friends compile through `re._compile`, not `re.compile`.
+    with mock.patch("re._compile", side_effect=AssertionError):
+        for i in range(1000):
+            assert is_url(f"https://test.com/path_{i}/") is True
+
+
+def test_isurl_is_cached() -> None:
+    """Test repeated checks of a url are served from the cache."""
+    utils._is_url.cache_clear()
+    assert utils.is_url("https://test.com/cached/") is True
+    assert utils.is_url("https://test.com/cached/") is True
+    assert utils._is_url.cache_info().hits == 1
+    assert utils.is_url(["https://test.com/cached/"]) is False
+
+
+def test_isurl_pathological() -> None:
+    """Test adversarial urls are rejected in linear time."""
+    urls = [
+        "http://" + "a_" * 200 + "text",
+        "http://" + "a" * 100000,
+        "https://host/" + "a" * 100000 + " ",
+    ]
+    # Bypass the cache so that the pattern is timed on every run, with a
+    # bound loose enough for shared runners that still catches backtracking.
+    is_url = utils._is_url.__wrapped__
+    start = time.perf_counter()
+    for url in urls:
+        assert is_url(url) is False
+    assert time.perf_counter() - start < 1
 
 
 def test_isurl_false() -> None:
@@ -32,10 +67,9 @@ def test_isurl_false() -> None:
         "invalid.com",
         "invalid",
         "invalid.com/with_path",
+        "https://test.com/valid_path/\n",
     ]
-    for url in invalid_urls:
-        valid = utils.is_url(url)
-        assert valid is False
+    assert utils.is_url_many(invalid_urls) == [False] * len(invalid_urls)
 
 
 def test_invalid_saf_numbers() -> None:
@@ -44,17 +78,50 @@ def test_invalid_saf_numbers() -> None:
     assert valid is False
 
 
-def test_valid_saf_numbers() -> None:
+@pytest.fixture(scope="module")
+def safaricom_numbers():
+    """Random numbers across the valid Safaricom prefixes, built once."""
+    subscriber = random.Random(999999).randrange
+    return [f"070{i}{subscriber(100000, 1000000)}" for i in range(0, 8)] + [
+        f"07{i}{subscriber(100000, 1000000)}"
+        for i in (*range(10, 29), *range(57, 59), *range(90, 92))
+    ]
+
+
+def test_valid_saf_numbers(safaricom_numbers) -> None:
     """Test valid safaricom numbers."""
+    results = utils.saf_number_fmt_many(safaricom_numbers)
+    assert all(valid for _, valid in results)
+
+
+def test_saf_number_fmt_many() -> None:
+    """Test batches keep the order and results of single checks."""
+    numbers = ["0721100100", "0731100100", "+254722100100"]
+    assert utils.saf_number_fmt_many(numbers) == [
+        utils.saf_number_fmt(number) for number in numbers
+    ]
+
+
+def test_saf_number_fmt_is_cached() -> None:
+    """Test repeated lookups of a number are served from the cache."""
+    utils.saf_number_fmt.cache_clear()
+    assert utils.saf_number_fmt("0721100100") == ("254721100100", True)
+    assert utils.saf_number_fmt("0721100100") == ("254721100100", True)
+    assert utils.saf_number_fmt.cache_info().hits == 1
+
 
-    def subscriber():
-        return random.randint(100000, 999999)
-
-    gen700_708 = [f"070{i}{subscriber()}" for i in range(0, 8)]
-    gen710_729 = [f"07{i}{subscriber()}" for i in range(10, 29)]
-    gen757_759 = [f"07{i}{subscriber()}" for i in range(57, 59)]
-    gen790_792 = [f"07{i}{subscriber()}" for i in range(90, 92)]
-    safaricom_numbers = gen700_708 + gen710_729 + gen757_759 + gen790_792
-    for number in safaricom_numbers:
-        _, valid = utils.saf_number_fmt(number)
-        assert valid is True
+def test_saf_number_fmt_matches_regex() -> None:
+    """Test the prefix check accepts exactly what the original regex did."""
+    saf_number_re = re.compile(
+        r"^(?:254|\+254|0)?(7(?:(?:[129][0-9])|(?:0[0-8])|(5[789])|(4[0-1]))[0-9]{6})$"  # noqa: E501
+    )
+    numbers = [
+        f"{prefix}{head}{tail}"
+        for prefix in ("", "0", "254", "+254", "+", "00", "2540")
+        for head in range(600, 900)
+        for tail in ("123456", "12345", "1234567", "12a456")
+    ] + ["", "0", "+254", "07211001001", "\u0667" * 9]
+    for number in numbers:
+        valid = saf_number_re.match(number)
+        expected = (f"254{valid.group(1)}", True) if valid else (None, False)
+        assert utils.saf_number_fmt(number) == expected, number